@@ -7,10 +7,11 @@ LICENSE = 'GPL3'
 DESCRIPTION = 'Toolbox for real-time analysis of physiological waveforms'
 DOWNLOAD_URL = 'http://github.com/rmarkello/rtpeaks'
 
+PYTHON_REQUIRES = '>=3.11'
+
 INSTALL_REQUIRES = [
     'numpy',
-    'scipy',
-    'future'
+    'scipy'
 ]
 
 TESTS_REQUIRE = [
@@ -1,8 +1,8 @@
 import sys
 
 if sys.platform == 'darwin':
-    from rtpeaks.keypress.mac import press_key
+    from rtpeaks.keypress.mac import press_key, press_keys
 elif sys.platform in ['win32', 'cygwin']:
-    from rtpeaks.keypress.windows import press_key
+    from rtpeaks.keypress.windows import press_key, press_keys
 else:
-    from rtpeaks.keypress.linux import press_key
+    from rtpeaks.keypress.linux import press_key, press_keys
@@ -1,4 +1,3 @@
-from __future__ import print_function, division, absolute_import
 import subprocess
 
 
@@ -18,3 +17,16 @@ def press_key(key):
         raise Exception('Failed to call `osascript` to simulate keypress. ' +
                         'Ensure `osascript` is installed on system and try ' +
                         'again.')
+
+
+def press_keys(keys):
+    """
+    Simulates keypresses of all `keys` with a single call to `press_key()`
+
+    Parameters
+    ----------
+    keys : list of str
+        Keys to press, in order
+    """
+
+    press_key(''.join(keys))
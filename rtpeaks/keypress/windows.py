@@ -2,7 +2,6 @@
 Totally lifted from https://stackoverflow.com/a/13615802
 """
 
-from __future__ import print_function, division, absolute_import
 import ctypes
 from ctypes import wintypes
 
@@ -190,7 +189,7 @@ class KEYBDINPUT(ctypes.Structure):
                 ("dwExtraInfo", wintypes.ULONG_PTR))
 
     def __init__(self, *args, **kwds):
-        super(KEYBDINPUT, self).__init__(*args, **kwds)
+        super().__init__(*args, **kwds)
         # some programs use the scan code even if KEYEVENTF_SCANCODE
         # isn't set in dwFflags, so attempt to map the correct code.
         if not self.dwFlags & KEYEVENTF_UNICODE:
@@ -237,3 +236,24 @@ def press_key(key):
               ki=KEYBDINPUT(wVk=VK_CODE[key],
                             dwFlags=KEYEVENTF_KEYUP))
     user32.SendInput(1, ctypes.byref(x), ctypes.sizeof(x))
+
+
+def press_keys(keys):
+    """
+    Simulates keypresses of all `keys` with a single call to SendInput
+
+    Parameters
+    ----------
+    keys : list of str
+        Keys to press (and release), in order
+    """
+
+    events = []
+    for key in keys:
+        events.append(INPUT(type=INPUT_KEYBOARD,
+                            ki=KEYBDINPUT(wVk=VK_CODE[key])))
+        events.append(INPUT(type=INPUT_KEYBOARD,
+                            ki=KEYBDINPUT(wVk=VK_CODE[key],
+                                          dwFlags=KEYEVENTF_KEYUP)))
+    inputs = (INPUT * len(events))(*events)
+    user32.SendInput(len(events), inputs, ctypes.sizeof(INPUT))
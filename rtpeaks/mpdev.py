@@ -7,7 +7,6 @@ threading and to play nicely with `rtp.py`, but the calls to mpdev.dll were
 from their initial repo
 """
 
-from __future__ import print_function, division, absolute_import
 try:
     from ctypes import windll, c_int, c_double, byref
     from ctypes.wintypes import DWORD
@@ -15,9 +14,15 @@ except ImportError:
     pass
 import multiprocessing as mp
 import os
-import Queue
+from queue import Full
+import struct
 import numpy as np
 import rtpeaks.process as rp
+from rtpeaks.utils import drain_queue
+
+# (time, amplitude) pairs sent through `sample_queue` are packed as two little-
+# endian doubles, which is much cheaper to pickle than a list of numpy floats
+SAMPLE_STRUCT = struct.Struct('<dd')
 
 
 def do_nothing():
@@ -66,14 +71,16 @@ def setup_biopac(dic):
 
     Parameters
     ----------
-    dic : multiprocessing.manager.Dict
+    dic : dict
         sampletime : float
             Number of milliseconds per sample
         channels : list
             From which channels to record data
-        connected : boolean
-            Whether process was able to successfully connect to the BIOPAC and
-            start relevant acquisition daemon
+
+    Returns
+    -------
+    WinDLL
+        Loaded from `mpdev.dll`
     """
 
     # load required library
@@ -127,8 +134,6 @@ def setup_biopac(dic):
     if result != 'MPSUCCESS':
         raise Exception('Failed to start data acquisition: {}'.format(result))
 
-    dic['connected'] = True
-
     return mpdev
 
 
@@ -167,6 +172,11 @@ def receive_data(dll, channels):
         Loaded from `mpdev.dll`
     channels : (1 x 16) array_like
         Specify whether to record from a given channel [on=1, off=0]
+
+    Returns
+    -------
+    tuple of float
+        Value sampled from each channel
     """
 
     num_points, read = len(channels), DWORD(0)
@@ -180,7 +190,7 @@ def receive_data(dll, channels):
     if result != 'MPSUCCESS':
         raise Exception('Failed to obtain a sample: {}'.format(result))
 
-    return np.array(tuple(data))
+    return tuple(data)
 
 
 def biopac_log(fname, channels, log_queue):
@@ -193,71 +203,112 @@ def biopac_log(fname, channels, log_queue):
         Name of log file to record sampled data
     channels : array_like
         From which channels data is being acquired
-    log_queue : multiprocessing.manager.Queue
-        Queue to receive data from `biopac_sample()` function
+    log_queue : multiprocessing.Queue
+        Queue to receive data from `biopac_sample()` function, with each
+        sample packed as little-endian doubles (time, then each channel)
     """
 
     ch = 'channel' + ',channel'.join(str(y) for y in channels)
-    with open(fname, 'a+') as f:
-        f.write('time,{0}\n'.format(ch))
-        f.flush()
+    ncols = len(channels) + 1
 
-        while True:
-            i = log_queue.get()
-            if isinstance(i, str) and i == 'kill': break
-            sig = ','.join(str(y) for y in list(i[1]))
-            f.write('{0},{1}\n'.format(i[0], sig))
-            f.flush()
+    # as in `rtp_log()`, samples are written straight to the file in one write
+    # per batch rather than being flushed one at a time
+    fd = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, 'time,{0}\n'.format(ch).encode())
+
+        done = False
+        while not done:
+            # the kill signal is the only str that comes through
+            samples = drain_queue(log_queue)
+            types = list(map(type, samples))
+            done = str in types
+            if done: samples = samples[:types.index(str)]
+            if not samples: continue
+
+            rows = np.frombuffer(b''.join(samples), dtype='<f8')
+            rows = rows.reshape(-1, ncols).tolist()
+            os.write(fd, ''.join(','.join(map(str, i)) + '\n'
+                                 for i in rows).encode())
 
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
-def biopac_sample(dic, sample_queue, log_queue):
+
+def biopac_sample(dic, connected, newest, record, pipe, sample_queue,
+                  log_queue, dropped):
     """
     Continuously samples data from the BIOPAC
 
     Parameters
     ----------
-    dic : multiprocessing.manager.Dict
+    dic : dict
         sampletime : float
             Number of milliseconds per sample
         channels : list
             From which channels to record data
-        newestsample : array_like
-            Most recently sampled data
-        newesttime : array_like
-            Timestamp of most recently sampled data
-        record : boolean, optional
-            Whether to record sampled data (i.e., send through `log_queue`).
-            Default: False
-        pipe : int, optional
-            Which data to send to `sample_queue`. Default: None
-    sample_queue : multiprocessing.manager.Queue
+    connected : multiprocessing.Event
+        Set once the BIOPAC is connected and acquiring; sampling continues
+        until it is cleared
+    newest : (multiprocessing.Array, multiprocessing.Value)
+        Most recently sampled data and its timestamp, updated with each sample
+    record : multiprocessing.Value
+        Whether to record sampled data (i.e., send through `log_queue`)
+    pipe : multiprocessing.Value
+        Which data to send to `sample_queue`, packed with `SAMPLE_STRUCT`; -1
+        to send nothing
+    sample_queue : multiprocessing.Queue
         Queue to send sampled data for use by another process
-    log_queue : multiprocessing.manager.Queue
-        Queue to send data to `biopac_log()` function
+    log_queue : multiprocessing.Queue
+        Queue to send data to `biopac_log()` function, with each sample packed
+        as little-endian doubles (time, then each channel)
+    dropped : multiprocessing.Value
+        Incremented (while holding its lock) for each sample that couldn't be
+        recorded because `log_queue` was full
     """
 
+    # samples are disposable, so don't wait on flushing them when exiting
+    sample_queue.cancel_join_thread()
+
     # set up acquisition
     mpdev = setup_biopac(dic)
+    connected.set()
 
-    # process samples
-    while dic['connected']:
-        data = receive_data(mpdev, dic['channels'])
-        currtime = dic['newesttime'] + dic['sampletime']
-
-        if not np.all(data == dic['newestsample']):
-            dic['newestsample'], dic['newesttime'] = data.copy(), currtime
+    channels, sampletime = dic['channels'], dic['sampletime']
+    newestsample, newesttime = newest
+    # samples are compared as tuples of floats, which is much cheaper than
+    # going through numpy for just a few channels
+    prevsample, prevtime = (0.,) * len(channels), 0
+    # like samples sent to `sample_queue`, samples to log are packed as
+    # doubles rather than pickled, and are unpacked a batch at a time
+    log_struct = struct.Struct('<{}d'.format(len(channels) + 1))
 
-            if dic['record']: log_queue.put([currtime, data])
-
-            pipe = dic['pipe']
-            if pipe is not None:
-                try: sample_queue.put_nowait([currtime, data[pipe]])
-                except Queue.Full: pass
+    # process samples
+    while connected.is_set():
+        data = receive_data(mpdev, channels)
+        currtime = prevtime + sampletime
+
+        if data != prevsample:
+            prevsample, prevtime = data, currtime
+            newestsample[:], newesttime.value = prevsample, prevtime
+
+            if record.value:
+                try: log_queue.put_nowait(log_struct.pack(currtime, *data))
+                except Full:
+                    with dropped.get_lock():
+                        dropped.value += 1
+
+            ch = pipe.value
+            if ch >= 0:
+                sample = SAMPLE_STRUCT.pack(currtime, data[ch])
+                try: sample_queue.put_nowait(sample)
+                except Full: pass
 
     shutdown_biopac(mpdev)
 
 
-class BIOPAC(object):
+class BIOPAC:
     """
     Class to sample and record data from BIOPAC MP device
 
@@ -304,39 +355,53 @@ class BIOPAC(object):
         if not isinstance(channels, (list, np.ndarray)):
             if isinstance(channels, (int)): channels = [channels]
             else: raise TypeError('Channels must be one of [list, array, int]')
-        f = dict(
+        # settings that don't change once the BIOPAC is set up; processes get
+        # their own copy when they start, so this doesn't need to be shared
+        self.dic = dict(
             samplerate=samplerate,
             sampletime=(1000. / samplerate),
-            newestsample=np.zeros(len(channels)),
-            newesttime=0,
-            pipe=None,
-            record=False,
-            connected=False,
             channels=np.array(channels),
             log=logfile
         )
         self.logfile = logfile
         self.dummy = dummy
-        self.manager = mp.Manager()
-        self.dic = self.manager.dict(**f)
-        self.sample_queue = self.manager.Queue()
-        self.log_queue = self.manager.Queue()
+        self.connected = mp.Event()
+        # these are updated (or checked) with every sample, so they're shared
+        # directly; `pipe` is the index of the channel sent for peak finding,
+        # or -1 for none. the flags are only ever set whole by this process, so
+        # they don't need a lock for `biopac_sample()` to read them
+        self.newest = (mp.Array('d', len(channels)), mp.Value('d', 0))
+        self.record = mp.Value('b', False, lock=False)
+        self.pipe = mp.Value('i', -1, lock=False)
+        # samples are dropped if the detector falls behind
+        self.sample_queue = mp.Queue(maxsize=4096)
+        # the log queue is bounded so a stalled `biopac_log()` can't use up
+        # all the memory (32767 is the largest size every platform allows);
+        # samples that don't fit are counted in `dropped` instead of blocking
+        self.log_queue = mp.Queue(maxsize=32767)
+        self.dropped = mp.Value('L', 0)
         self.log_process = None
 
         if not self.dummy:
             self.sample_process = rp.Process(name='biopac_sample',
                                              target=biopac_sample,
                                              args=(self.dic,
+                                                   self.connected,
+                                                   self.newest,
+                                                   self.record,
+                                                   self.pipe,
                                                    self.sample_queue,
-                                                   self.log_queue))
+                                                   self.log_queue,
+                                                   self.dropped))
         else:
             self.sample_process = rp.Process(name='biopac_sample',
                                              target=do_nothing)
-            self.dic['connected'] = True
+            self.connected.set()
 
         self.sample_process.daemon = True
         self.sample_process.start()
-        while not self.dic['connected']: pass
+        if not self.dummy: rp.prioritize(self.sample_process.pid, cpus=[3])
+        self.connected.wait()
 
     def start_recording(self, run=None):
         """
@@ -349,9 +414,9 @@ class BIOPAC(object):
             of experimental sessions. Default: None
         """
 
-        if self.dic['record']:
+        if self.record.value:
             self.stop_recording()
-        self.dic['record'] = True
+        self.record.value = True
 
         if run is not None:
             fname = "{0}-run{1}_biopac_data.csv".format(self.logfile, str(run))
@@ -369,30 +434,34 @@ class BIOPAC(object):
     def stop_recording(self):
         """Halts logging/recording of sampled data"""
 
-        self.dic['record'] = False
+        self.record.value = False
         if self.log_process is not None:
             self.log_queue.put('kill')
             self.log_process.join()
             self.log_process = None
+        with self.dropped.get_lock():
+            dropped, self.dropped.value = self.dropped.value, 0
+        if dropped > 0:
+            print('Warning: {} samples were dropped from the log because it '
+                  'couldn\'t keep up.'.format(dropped))
 
     @property
     def sample(self):
         """Most recently sampled data"""
 
-        return self.dic['newestsample']
+        return np.array(self.newest[0][:])
 
     @property
     def timestamp(self):
         """Timestamp of most recently sampled data"""
 
-        return self.dic['newesttime']
+        return self.newest[1].value
 
     def close(self):
         """Closes connection with BIOPAC. Should only be called once."""
 
-        self.dic['connected'] = False
-        if self.dic['pipe'] is not None:
-            self.dic['pipe'] = None
-        if self.dic['record']:
+        self.connected.clear()
+        self.pipe.value = -1
+        if self.record.value:
             self.stop_recording()
         self.sample_process.join()
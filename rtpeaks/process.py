@@ -1,5 +1,6 @@
-from future.utils import raise_
 import multiprocessing as mp
+import os
+import sys
 
 
 class Process(mp.Process):
@@ -11,7 +12,7 @@ class Process(mp.Process):
     """
 
     def __init__(self, *args, **kwargs):
-        super(Process, self).__init__(*args, **kwargs)
+        super().__init__(*args, **kwargs)
 
     def saferun(self):
         if self._target is not None:
@@ -22,4 +23,91 @@ class Process(mp.Process):
         except Exception as e:
             import sys
             _, exception, tb = sys.exc_info()
-            raise_(exception, None, tb)
+            raise exception.with_traceback(tb)
+
+
+def prioritize(pid, cpus=None):
+    """
+    Raises priority of process `pid` and (optionally) pins it to `cpus`
+
+    This is best effort only: it uses psutil if installed (falling back to
+    the Windows API via ctypes on Windows, and to `os` elsewhere), and quietly
+    skips anything that fails, e.g. because the process has already exited or
+    the current user isn't allowed to change it.
+
+    Parameters
+    ----------
+    pid : int
+        ID of process to prioritize
+    cpus : list of int, optional
+        CPUs to pin process to; any that don't exist on this machine are
+        ignored. Default: None
+    """
+
+    ncpus = mp.cpu_count()
+    if cpus is not None: cpus = [c for c in cpus if c < ncpus]
+
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        try: proc = psutil.Process(pid)
+        except psutil.Error: return
+        if cpus and hasattr(proc, 'cpu_affinity'):  # not available on OSX
+            try: proc.cpu_affinity(cpus)
+            except (psutil.Error, OSError): pass
+        try: proc.nice(getattr(psutil, 'HIGH_PRIORITY_CLASS', -10))
+        except (psutil.Error, OSError): pass
+    elif sys.platform == 'win32':
+        _win_prioritize(pid, cpus)
+    else:
+        if cpus and hasattr(os, 'sched_setaffinity'):
+            try: os.sched_setaffinity(pid, cpus)
+            except OSError: pass
+        if hasattr(os, 'setpriority'):
+            try: os.setpriority(os.PRIO_PROCESS, pid, -10)
+            except OSError: pass
+
+
+def _win_prioritize(pid, cpus=None):
+    """
+    Windows equivalent of `prioritize()` for when psutil isn't installed
+
+    Parameters
+    ----------
+    pid : int
+        ID of process to prioritize
+    cpus : list of int, optional
+        CPUs to pin process to. Default: None
+    """
+
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_SET_INFORMATION = 0x0200
+    PROCESS_QUERY_INFORMATION = 0x0400
+    HIGH_PRIORITY_CLASS = 0x0080
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL,
+                                     wintypes.DWORD)
+    kernel32.SetProcessAffinityMask.argtypes = (wintypes.HANDLE,
+                                                ctypes.c_size_t)
+    kernel32.SetPriorityClass.argtypes = (wintypes.HANDLE, wintypes.DWORD)
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    # a null handle means the process is gone or we aren't allowed to touch
+    # it; failed calls below just return 0, which is likewise ignored
+    handle = kernel32.OpenProcess(PROCESS_SET_INFORMATION |
+                                  PROCESS_QUERY_INFORMATION, False, pid)
+    if not handle: return
+
+    try:
+        if cpus:
+            kernel32.SetProcessAffinityMask(handle, sum(1 << c for c in cpus))
+        kernel32.SetPriorityClass(handle, HIGH_PRIORITY_CLASS)
+    finally:
+        kernel32.CloseHandle(handle)
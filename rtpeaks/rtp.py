@@ -1,15 +1,19 @@
-from __future__ import print_function, division, absolute_import
 import itertools
-import Queue
+import multiprocessing as mp
+import os
+from queue import Empty
+import random
 import time
 import numpy as np
-from rtpeaks.keypress import press_key
-from rtpeaks.mpdev import BIOPAC
+from rtpeaks.keypress import press_key, press_keys
+from rtpeaks.mpdev import BIOPAC, SAMPLE_STRUCT
 import rtpeaks.process as rp
-from rtpeaks.utils import (peak_or_trough, gen_thresh)
+from rtpeaks.utils import (gen_thresh, gen_detector, compile_kernels,
+                           drain_queue, AppendBuffer, SharedRing,
+                           load_biopac_csv)
 
 
-def rtp_log(fname, que):
+def rtp_log(fname, que, debug=False):
     """
     Creates log file to record detected peaks/troughs
 
@@ -17,20 +21,39 @@ def rtp_log(fname, que):
     ----------
     fname : str
         Name of log file to record sampled data
-    que : multiprocessing.manager.Queue
+    que : multiprocessing.Queue
         Queue to receive detected peaks/troughs from `rtp_finder()` function
+    debug : bool, optional
+        Whether to run in debug mode. This will cause the function to print
+        updates (e.g., 'Found peak/trough') for each detection it receives, so
+        that `rtp_finder()` doesn't have to. Default: False
     """
 
-    with open(fname, 'a+') as f:
-        f.write('time,amplitude,peak\n')
-        f.flush()
+    # rows go straight to the file in one write per batch (no buffering, so
+    # nothing to flush), and are only synced to disk once we're done
+    fd = os.open(fname, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, b'time,amplitude,peak\n')
+
+        done = False
+        while not done:
+            rows = []
+            for i in drain_queue(que):
+                if isinstance(i, str) and i == 'kill':
+                    done = True
+                    break
+                rows.append(i)
+            if rows:
+                os.write(fd, ''.join(','.join(map(str, i)) + '\n'
+                                     for i in rows).encode())
+
+            if debug:
+                for i in rows:
+                    print('Found {}'.format('peak' if i[2] else 'trough'))
 
-        while True:
-            i = que.get()
-            if isinstance(i, str) and i == 'kill': break
-            out = '{0}\n'.format(','.join(str(y) for y in list(i)))
-            f.write(out)
-            f.flush()
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
 
 def get_baseline(logfile, channel, samplerate):
@@ -66,150 +89,230 @@ def get_baseline(logfile, channel, samplerate):
         print('Can\'t load peakdet; ignoring baseline data.')
         return
 
-    data = np.loadtxt('{0}-run_baseline_biopac_data.csv'.format(logfile),
-                      skiprows=1,
-                      delimiter=',',
-                      usecols=[0, channel + 1])
-    fs = 1000. / np.mean(np.diff(data[:, 0]))  # sampling rate of BIOPAC
+    data = load_biopac_csv('{0}-run_baseline_biopac_data.csv'.format(logfile),
+                           usecols=[0, channel + 1])
+    # samples are evenly spaced, so no need to average over np.diff()
+    fs = 1000. * (data.shape[0] - 1) / (data[-1, 0] - data[0, 0])
 
-    # downsample data if necessary
+    # downsample data if necessary (PeakFinder doesn't modify its input, so
+    # there's no need to copy it otherwise)
     if samplerate < fs:
         indata = data[np.arange(0, data.shape[0], 1000 / samplerate,
                                 dtype='int64')]
     else:
-        indata = data.copy()
+        indata = data
 
     pf = PeakFinder(indata[:, 1], fs=samplerate)
     if pf.fs != 1000: pf.interpolate(np.floor(1000 / pf.fs))
     pf.get_peaks(thresh=0.2)
 
     size = np.min([pf.troughinds.size, pf.peakinds.size])
-    p = np.floor(pf.peakinds[-size:] / np.floor(1000 / fs)).astype('int64')
-    t = np.floor(pf.troughinds[-size:] / np.floor(1000 / fs)).astype('int64')
+    step = np.floor(1000 / fs)
+
+    p = data[(pf.peakinds[-size:] // step).astype('int64')]
+    t = data[(pf.troughinds[-size:] // step).astype('int64')]
 
-    pi = np.column_stack((np.ones([p.size, 1]), data[p, 0], data[p, 1]))
-    ti = np.column_stack((np.zeros([t.size, 1]), data[t, 0], data[t, 1]))
+    # peaks and troughs are each already in time order, so merge them straight
+    # into the output array rather than stacking and sorting
+    pi = np.arange(size) + np.searchsorted(t[:, 0], p[:, 0], side='left')
+    ti = np.arange(size) + np.searchsorted(p[:, 0], t[:, 0], side='right')
 
-    out = np.vstack((pi, ti))
-    out = out[np.argsort(out[:, 1])]
+    out = np.empty((2 * size, 3))
+    out[pi, 0], out[pi, 1:] = 1, p
+    out[ti, 0], out[ti, 1:] = 0, t
 
     return out
 
 
-def rtp_finder(dic, sample_queue, peak_queue, debug=False):
+def rtp_finder(dic, samplerate, sample_queue, peak_queue, peak_times,
+               newesttime, debug=False, max_history=None):
     """
     Detects peaks/troughs in real time from BIOPAC data
 
     Parameters
     ----------
-    dic : multiprocessing.manager.Dict
-        samplerate : list
-            Sampling rate
-        baseline : bool, optional
-            Whether a baseline session was run. Default: False
+    dic : dict
         log : str,
-            name of logfile (required if dic['baseline'])
-    sample_queue : multiprocessing.manager.Queue
-        Queue for receiving sampled data (i.e., from `biopac_sample()`)
-    peak_queue : multiprocessing.manager.Queue
+            name of logfile (required if a baseline session was run)
+    samplerate : multiprocessing.Value
+        Sampling rate at which to search for peaks/troughs
+    sample_queue : multiprocessing.Queue
+        Queue for receiving sampled data (i.e., from `biopac_sample()`), packed
+        with `SAMPLE_STRUCT`. If a baseline session was run the first item is
+        instead [channel, samplerate] from `RTP.stop_baseline()`
+    peak_queue : multiprocessing.Queue
         Queue to send detected peaks/troughs from `rtp_log()` function
+    peak_times : rtpeaks.utils.SharedRing
+        Ring to which the times of detected peaks are added (for `RTP.rate`)
+    newesttime : multiprocessing.Value
+        Timestamp of most recently sampled data (only used if `debug`)
     debug : bool, optional
-        Whether to run in debug mode. This will cause the function to print
-        updates (e.g., 'Found peak/trough') rather than imitating keypresses.
-        Default: False
+        Whether to run in debug mode. This will cause the function to skip
+        imitating keypresses; updates (e.g., 'Found peak/trough') are instead
+        printed by `rtp_log()`. Default: False
+    max_history : int, optional
+        Maximum number of detections (beyond the seed / baseline ones) used to
+        generate thresholds. Capping this keeps threshold generation from
+        slowing down over long recordings, but changes which peaks/troughs are
+        detected. Default: None (use all detections)
 
     Returns
     -------
     Imitates `p` and `t` keypress for each detected peak and trough
     """
 
+    # get compiling out of the way before any samples come in
+    compile_kernels()
+
     # this will block until an item is available in sample_queue
-    sig = sample_queue.get()
-    if isinstance(sig, str) and sig == 'kill': return
-    else: sig = np.atleast_2d(np.array(sig))
-    last_found = np.array([[0, 0, 0],
-                           [1, 0, 0],
-                           [-1, 0, 0]] * 2)
-
-    if dic['baseline']:
-        out = get_baseline(dic['log'], int(sig[-1, 0]), int(sig[-1, 1]))
-        last_found = out.copy()
-        t_thresh = gen_thresh(last_found[:-1])[0, 0]
+    i = sample_queue.get()
+    if isinstance(i, str) and i == 'kill': return
+    # the first `nseed` rows of last_found (here, starter rows) are counted
+    # twice when generating thresholds, rather than being stored twice, and the
+    # first `nkeep` rows are always used for thresholds
+    last_found = AppendBuffer(3)
+    last_found.extend([[0, 0, 0],
+                       [1, 0, 0],
+                       [-1, 0, 0]])
+    nseed = nkeep = 3
+
+    def history_thresh():
+        # thresholds from all but the most recent detection, with the seed
+        # rows doubled up; if `max_history` is set, only use the last
+        # `max_history` of the detections beyond the first `nkeep` rows
+        lf = last_found.view()
+        if max_history is None:
+            return gen_thresh(np.concatenate((lf[:nseed], lf[:-1])))
+        recent = lf[max(nkeep, len(lf) - 1 - max_history):-1]
+        return gen_thresh(np.concatenate((lf[:nseed], lf[:nkeep], recent)),
+                          n_total=nseed + len(lf) - 1)
+
+    # samples since the last detection; detections are at most a few seconds
+    # apart, so leave room for 5s worth up front to avoid having to grow it
+    sig = AppendBuffer(2, capacity=int(5 * samplerate.value) + 1)
+
+    # samples are sent as bytes, so anything else means a baseline was run
+    baseline = not isinstance(i, bytes)
+
+    if baseline:
+        # first item is [channel, samplerate] from `RTP.stop_baseline()`
+        out = get_baseline(dic['log'], int(i[0]), int(i[1]))
+        last_found.reset(out)
+        nseed, nkeep = 0, len(out)
+        # thresholds from the baseline only depend on `out`, so generate them
+        # once here and reuse them whenever we reset to baseline
+        base_thresh = gen_thresh(out[:-1])
 
         # now wait for the real signal!
-        sig = sample_queue.get()
-        if isinstance(sig, str) and sig == 'kill': return
-        else: sig = np.atleast_2d(np.array(sig))
-        last_found[-1, 1] = sig[0, 0] - t_thresh
+        i = sample_queue.get()
+        if isinstance(i, str) and i == 'kill': return
+        sig.append(SAMPLE_STRUCT.unpack(i))
+        last_found.view()[-1, 1] = sig.view()[0, 0] - base_thresh[0, 0]
+        thresh = base_thresh
+    else:
+        sig.append(SAMPLE_STRUCT.unpack(i))
+        thresh = history_thresh()  # generate thresholds
+
+    # class, time, height of last detection
+    last = tuple(last_found.view()[-1])
+    st = np.ceil(1000. / samplerate.value)  # sampling time
+    detector = gen_detector(thresh, st)
 
-    thresh = gen_thresh(last_found[:-1])  # generate thresholds
-    st = np.ceil(1000. / dic['samplerate'])  # sampling time
+    # only reset to baseline if we have one to reset to
+    timeout = 10000 if baseline else np.inf
 
     while True:
-        i = sample_queue.get()
-        if isinstance(i, str) and i == 'kill': return
-        if i[0] < sig[-1, 0] + st: continue
-
-        sig = np.vstack((sig, i))
-        detected = peak_or_trough(sig, last_found, thresh, st)
-
-        if np.any(detected):
-            # get index of extrema
-            extrema, peak = np.any(detected), int(bool(detected[0]))
-
-            # add to last_found and reload thresholds
-            last_found = np.vstack((last_found,
-                                    np.append([peak], sig[extrema])))
-            # if we didn't baseline and have gotten some peaks/troughs
-            # fix the last_found array so as not to have starter datapoints
-            if (not dic['baseline'] and len(last_found) > 7 and
-                    np.any(last_found[:, 1] == 0)):
-                last_found = last_found[np.where(last_found[:, 1] != 0)[0]]
-                last_found = np.vstack((last_found, last_found))
-
-            # regenerate thresholds
-            thresh = gen_thresh(last_found[:-1])
-
-            # if extrema was detected "immediately" (i.e., within 2 datapoints
-            # of real-time) then log detection.
-            if extrema == len(sig) - 2:
-                if debug:
-                    print('Found {}'.format('peak' if peak else 'trough'))
-                    peak_queue.put(np.append(sig[-1],
-                                             [peak, dic['newesttime']]))
-                else:
-                    press_key('p' if peak else 't')
-                    peak_queue.put(np.append(sig[-1], [peak]))
-
-            # add detected peak time to dic['peaks'] for use in .rate
-            if peak:
-                dic['peaks'] = np.append(dic['peaks'], sig[extrema, 0])
-
-            # reset sig
-            sig = np.atleast_2d(sig[-1])
-
-        # reset to baseline if it's been more than 10 seconds
-        elif dic['baseline'] and (sig[-1, 0] - last_found[-1, 1]) > 10000:
-            last_found = out.copy()
-            t_thresh = gen_thresh(last_found[:-1])[0, 0]
-
-            sig = np.atleast_2d(sig[-1])
-            last_found[-1, 1] = sig[0, 0] - t_thresh
-
-            thresh = gen_thresh(last_found[:-1])
-
-
-def dummy_keypress(dic, sample_queue, debug=False):
+        samples, found = drain_queue(sample_queue), []
+        # the kill signal is the only str that comes through, so look for it
+        # by type rather than comparing every sample against it
+        types = list(map(type, samples))
+        kill = str in types
+        if kill: samples = samples[:types.index(str)]
+
+        # samples are packed with `SAMPLE_STRUCT` (i.e., two little-endian
+        # doubles), so they can be unpacked all at once
+        new = np.frombuffer(b''.join(samples), dtype='<f8').reshape(-1, 2)
+
+        # downsample to `st` and add to sig
+        keep, nxt = [], sig.view()[-1, 0] + st
+        for n, t in enumerate(new[:, 0].tolist()):
+            if t >= nxt:
+                keep.append(n)
+                nxt = t + st
+        start = len(sig)
+        sig.extend(new[keep])
+
+        # check all the new samples, handling detections (and resets to
+        # baseline) as they come up
+        while start < len(sig):
+            k, detected, peak, extrema = detector(sig.view(), last,
+                                                  start=start,
+                                                  timeout=timeout)
+            if k == len(sig): break
+            i = tuple(sig.view()[k].tolist())
+
+            if detected:
+                peak = int(peak)
+
+                # add to last_found and reload thresholds
+                last = (peak,) + tuple(sig.view()[extrema])
+                last_found.append(last)
+                # if we didn't baseline and have gotten some peaks/troughs
+                # fix the last_found array so as not to have starter
+                # datapoints
+                lf = last_found.view()
+                if (not baseline and len(lf) + nseed > 7 and
+                        np.any(lf[:, 1] == 0)):
+                    last_found.reset(lf[lf[:, 1] != 0])
+                    nseed = nkeep = len(last_found)
+
+                # regenerate thresholds
+                thresh = history_thresh()
+                detector = gen_detector(thresh, st)
+
+                # if extrema was detected "immediately" (i.e., within 2
+                # datapoints of real-time) then queue it up for logging
+                if extrema == k - 1:
+                    found.append((peak, i))
+
+                # add detected peak time to peak_times for use in .rate
+                if peak: peak_times.append(last[1])
+
+            # reset to baseline if it's been more than 10 seconds
+            else:
+                last_found.reset(out)
+                last_found.view()[-1, 1] = i[0] - base_thresh[0, 0]
+                last = tuple(last_found.view()[-1])
+                thresh = base_thresh
+                detector = gen_detector(thresh, st)
+
+            # restart sig from the current sample
+            sig.drop(k)
+            start = 1
+
+        # log detections from this batch of samples, imitating all the
+        # keypresses at once
+        if found and not debug:
+            press_keys(['p' if peak else 't' for peak, row in found])
+        for peak, row in found:
+            if debug:
+                peak_queue.put(row + (float(peak), newesttime.value))
+            else:
+                peak_queue.put(row + (float(peak),))
+
+        if kill: return
+
+
+def dummy_keypress(pipe, sample_queue, debug=False):
     """
     Simulates peak/trough detection by making random keypresses
 
     Parameters
     ----------
-    dic : multiprocessing.manager.Dict
-        pipe : int
-            Determines when to simulate keypresses (i.e., this is set by calls
-            to `RTP.start_peak_finding()` and `RTP.stop_peak_finding()`)
-    sample_queue : multiprocessing.manager.Queue
+    pipe : multiprocessing.Value
+        Keypresses are only simulated while this is not -1 (i.e., this is set
+        by calls to `RTP.start_peak_finding()` and `RTP.stop_peak_finding()`)
+    sample_queue : multiprocessing.Queue
         Queue for receiving kill signal by call to `RTP.close()`
     debug : bool, optional
         Whether to run in debug mode. This will cause the function to print
@@ -218,19 +321,22 @@ def dummy_keypress(dic, sample_queue, debug=False):
     """
 
     cycle = itertools.cycle(['p', 't'])
+    rng = random.Random()
 
     while True:
-        try: i = sample_queue.get_nowait()
-        except Queue.Empty: i = None
+        # nothing but the kill signal comes through sample_queue in dummy
+        # mode, so block briefly rather than spinning on an empty queue
+        try: i = sample_queue.get(timeout=0.1)
+        except Empty: i = None
         if isinstance(i, str) and i == 'kill': return
 
-        if dic['pipe'] is None: continue
+        if pipe.value < 0: continue
 
-        time.sleep(np.random.randint(5))
-        key = cycle.next()
-        if debug and dic['pipe'] is not None:
+        time.sleep(rng.randrange(5))
+        key = next(cycle)
+        if debug and pipe.value >= 0:
             print('Found {}'.format('peak' if key == 'p' else 'trough'))
-        elif dic['pipe'] is not None:
+        elif pipe.value >= 0:
             press_key(key)
 
 
@@ -261,6 +367,9 @@ class RTP(BIOPAC):
         Whether to run in dummy mode. This is for testing purposes only. The
         program will not connect to the BIOPAC and no data will be recorded.
         All other functionality should be accessible. Default: False
+    max_history : int, optional
+        Maximum number of detections (beyond the baseline ones) used to
+        generate peak/trough thresholds; see `rtp_finder()`. Default: None
 
     Methods
     -------
@@ -273,7 +382,7 @@ class RTP(BIOPAC):
     Attributes
     ----------
     rate : float
-        Average rate of peaks detected over last 5 sec in units (peaks / sec)
+        Average rate of peaks detected over last 5 sec in units (peaks / min)
 
     Usage
     -----
@@ -288,31 +397,42 @@ class RTP(BIOPAC):
     """
 
     def __init__(self, logfile, channels, samplerate=500,
-                 debug=False, dummy=False):
-        super(RTP, self).__init__(logfile, channels,
-                                  samplerate=samplerate, dummy=dummy)
+                 debug=False, dummy=False, max_history=None):
+        super().__init__(logfile, channels,
+                         samplerate=samplerate, dummy=dummy)
         self.debug = debug
+        self.max_history = max_history
+        self._ch_idx = dict((c, n) for n, c in
+                            enumerate(self.dic['channels'].tolist()))
         self.dic['baseline'] = False
-        self.dic['peaks'] = np.empty(0, dtype='float')
+        # rate to search for peaks at; this can be changed by
+        # `start_peak_finding()` after `rtp_finder()` has started
+        self.peak_samplerate = mp.Value('d', samplerate)
+        self.peak_times = SharedRing()
         self.peak_log_process = None
-        self.peak_queue = self.manager.Queue()
+        self.peak_queue = mp.Queue()
 
         if not self.dummy:
             self.peak_process = rp.Process(name='rtp_finder',
                                            target=rtp_finder,
                                            args=(self.dic,
+                                                 self.peak_samplerate,
                                                  self.sample_queue,
                                                  self.peak_queue,
-                                                 self.debug))
+                                                 self.peak_times,
+                                                 self.newest[1],
+                                                 self.debug,
+                                                 self.max_history))
         else:
             self.peak_process = rp.Process(name='rtp_finder',
                                            target=dummy_keypress,
-                                           args=(self.dic,
+                                           args=(self.pipe,
                                                  self.sample_queue,
                                                  self.debug))
 
         self.peak_process.daemon = True
         self.peak_process.start()
+        if not self.dummy: rp.prioritize(self.peak_process.pid, cpus=[2])
 
     def start_peak_finding(self, channel=None, samplerate=None, run=None):
         """
@@ -345,16 +465,15 @@ class RTP(BIOPAC):
 
         # set peak finding sample rate
         if isinstance(samplerate, (int, float)):
-            self.dic['samplerate'] = samplerate
+            self.peak_samplerate.value = samplerate
 
         # turn off peak finding if it's currently happening
-        if self.dic['pipe'] is not None:
+        if self.pipe.value >= 0:
             self.stop_peak_finding()
 
         # start recording and turn peak finding back on
         self.start_recording(run=run)
-        self.dic['pipe'] = np.argwhere(self.dic['channels'] ==
-                                       channel).squeeze()
+        self.pipe.value = self._ch_idx[channel]
 
         # start peak logging process
         if run is not None:
@@ -366,7 +485,8 @@ class RTP(BIOPAC):
         self.peak_log_process = rp.Process(name='rtp_log',
                                            target=rtp_log,
                                            args=(fname,
-                                                 self.peak_queue))
+                                                 self.peak_queue,
+                                                 self.debug))
         self.peak_log_process.daemon = True
         self.peak_log_process.start()
 
@@ -374,7 +494,7 @@ class RTP(BIOPAC):
         """Stops peak finding process (and stops data recording)"""
 
         # turn off pipe and stop recording
-        self.dic['pipe'] = None
+        self.pipe.value = -1
         self.stop_recording()
 
         # ensure peak logging process quits successfully
@@ -402,7 +522,7 @@ class RTP(BIOPAC):
         """
 
         self.start_recording(run='_baseline')
-        self.base_chan = np.where(self.dic['channels'] == channel)[0][0]
+        self.base_chan = self._ch_idx[channel]
         self.base_rate = samplerate
 
     def stop_baseline(self):
@@ -424,14 +544,15 @@ class RTP(BIOPAC):
         self.sample_queue.put('kill')
         self.peak_process.join()
 
-        super(RTP, self).close()
+        super().close()
 
     @property
     def rate(self):
-        """Returns average rate of peaks in last 5 sec (units: peaks / sec)"""
+        """Returns average rate of peaks in last 5 sec (units: peaks / min)"""
+
+        curr_time = self.timestamp
+        peaks = self.peak_times.recent()
+        peaks = peaks[np.searchsorted(peaks, curr_time - 5000., side='right'):]
+        if peaks.size < 2: return
 
-        curr_time = self.dic['newesttime']
-        peaks = self.dic['peaks'][self.dic['peaks'] > (curr_time - 5000.)]
-        rate = np.diff(peaks)
-        if rate.size == 0: return
-        return 60. / (np.diff(rate).mean() / 1000.)
+        return 60000. * (peaks.size - 1) / (peaks[-1] - peaks[0])
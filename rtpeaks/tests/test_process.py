@@ -0,0 +1,11 @@
+import multiprocessing as mp
+import rtpeaks.process as rp
+
+
+def test_prioritize_exited():
+    # prioritizing is best effort, so a process that's already gone is fine
+    proc = mp.Process(target=int)
+    proc.start()
+    proc.join()
+    rp.prioritize(proc.pid, cpus=[0, 1, 2, 3, 1024])
+    rp.prioritize(proc.pid)
@@ -1,10 +1,11 @@
-from __future__ import print_function, division, absolute_import
 import os
 import os.path as op
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.signal import savgol_filter as savgol
-from rtpeaks.rtp import get_baseline, peak_or_trough, gen_thresh
+from rtpeaks.rtp import get_baseline
+from rtpeaks.utils import (peak_or_trough, gen_thresh, load_biopac_csv,
+                           AppendBuffer)
 
 
 def test_rtp_finder(signal, dic, plot=False):
@@ -29,10 +30,11 @@ def test_rtp_finder(signal, dic, plot=False):
         Detected peaks and troughs
     """
 
-    detected = []
-    last_found = np.array([[0, 0, 0],
-                           [1, 0, 0],
-                           [-1, 0, 0]] * 2)
+    detected = AppendBuffer(3)
+    found = AppendBuffer(3)
+    found.extend([[0, 0, 0],
+                  [1, 0, 0],
+                  [-1, 0, 0]] * 2)
 
     if plot:
         fig, ax = plt.subplots(1)
@@ -55,24 +57,31 @@ def test_rtp_finder(signal, dic, plot=False):
         out = get_baseline(op.join(os.getcwd(), 'data', dic['log']),
                            dic['channelloc'],
                            dic['samplerate'])
-        last_found = out.copy()
-        t_thresh = gen_thresh(last_found[:-1])[0, 0]
+        found.reset(out)
+        t_thresh = gen_thresh(out[:-1])[0, 0]
 
-        last_found[-1, 1] = signal[0, 0] - t_thresh
+        found.view()[-1, 1] = signal[0, 0] - t_thresh
 
+    last_found = found.view()
     thresh = gen_thresh(last_found[:-1])
     if plot: tdiff = thresh[0, 0] - thresh[0, 1]
-    sig = np.atleast_2d(signal[0])
+    buf = AppendBuffer(2)
+    buf.append(signal[0])
+    sig = buf.view()
 
     st = np.ceil(1000. / dic['samplerate'])
     if plot: x = np.arange(signal[0, 0], signal[-1, 0], st)
 
+    # time at which the next sample can be taken
+    nxt = signal[0, 0] + st
     for i in signal[1:]:
-        if i[0] < sig[-1, 0] + st: continue
+        if i[0] < nxt: continue
 
-        sig = np.vstack((sig, i))
+        nxt = i[0] + st
+        buf.append(i)
+        sig = buf.view()
         if len(sig) > 3: sig[:, 1] = savgol(sig[:, 1], 3, 1)
-        peak, trough = peak_or_trough(sig, last_found, thresh, st)
+        peak, trough = peak_or_trough(sig, last_found[-1], thresh, st)
 
         if plot:
             # if time since last det > upper bound of normal time interval
@@ -119,34 +128,35 @@ def test_rtp_finder(signal, dic, plot=False):
             ex, l = peak or trough, int(bool(peak))
 
             # add to last_found
-            last_found = np.vstack((last_found, np.append([l], sig[ex])))
+            found.append((l, sig[ex, 0], sig[ex, 1]))
+            last_found = found.view()
             if (not dic['baseline'] and len(last_found) > 7 and
                     np.any(last_found[:, 1] == 0)):
-                last_found = last_found[np.where(last_found[:, 1] != 0)[0]]
-                last_found = np.vstack((last_found, last_found))
+                keep = last_found[last_found[:, 1] != 0]
+                found.reset(keep)
+                found.extend(keep)
+                last_found = found.view()
             thresh = gen_thresh(last_found[:-1])
             if plot: tdiff = thresh[0, 0] - thresh[0, 1]
 
             # if extrema was detected "immediately" then log detection
             if len(sig) - ex <= 3:
-                detected.append(np.append(sig[-1], [l]))
+                detected.append((sig[-1, 0], sig[-1, 1], l))
             else:
-                detected.append(np.append(sig[ex], [2]))
+                detected.append((sig[ex, 0], sig[ex, 1], 2))
 
             # reset sig
-            sig = np.atleast_2d(sig[-1])
+            buf.drop(len(buf) - 1)
+            sig = buf.view()
 
-    return np.array(detected)
+    return detected.view()
 
 
 def test_RTP(f, channelloc=0, samplerate=1000, plot=False, rtplot=False):
     """
     """
     fname = op.join(os.getcwd(), 'data', '{}-run1_biopac_data.csv'.format(f))
-    signal = np.loadtxt(fname,
-                        skiprows=1,
-                        usecols=[0, channelloc + 1],
-                        delimiter=',')
+    signal = load_biopac_csv(fname, usecols=[0, channelloc + 1])
 
     dic = {'log': f,
            'samplerate': samplerate,
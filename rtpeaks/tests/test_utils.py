@@ -0,0 +1,239 @@
+import multiprocessing as mp
+import os
+import os.path as op
+import shutil
+import threading
+import time
+import numpy as np
+import pytest
+from scipy.signal import find_peaks
+import rtpeaks.utils as utils
+from rtpeaks.utils import (AppendBuffer, SharedRing, drain_queue,
+                           gen_detector, gen_thresh, load_biopac_csv)
+
+
+def test_AppendBuffer_growth():
+    buf = AppendBuffer(3, capacity=4)
+    rows = np.arange(30, dtype=float).reshape(10, 3)
+    for row in rows[:5]: buf.append(row)
+    buf.extend(rows[5:])
+
+    # capacity is doubled as needed, and data are stored column by column
+    assert len(buf) == 10
+    assert buf._data.shape == (3, 16)
+    assert buf.view().shape == (10, 3)
+    assert buf.view().base is buf._data
+    assert buf.view()[:, 0].flags['C_CONTIGUOUS']
+    np.testing.assert_array_equal(buf.view(), rows)
+
+    # views are writeable and write through to the buffer
+    buf.view()[-1, 1] = -1
+    assert buf._data[1, 9] == -1
+
+
+def test_AppendBuffer_drop_reset():
+    rows = np.arange(12, dtype=float).reshape(6, 2)
+    buf = AppendBuffer(2, capacity=2)
+    buf.extend(rows)
+
+    buf.drop(4)
+    np.testing.assert_array_equal(buf.view(), rows[4:])
+    buf.append(rows[0])
+    np.testing.assert_array_equal(buf.view(), rows[[4, 5, 0]])
+    buf.drop(10)
+    assert len(buf) == 0
+
+    buf.reset(rows[:3])
+    np.testing.assert_array_equal(buf.view(), rows[:3])
+    buf.reset()
+    assert buf.view().shape == (0, 2)
+
+
+def test_SharedRing_wraparound():
+    ring = SharedRing(capacity=4)
+    assert ring.recent().size == 0
+
+    for n in range(3): ring.append(n)
+    np.testing.assert_array_equal(ring.recent(), [0, 1, 2])
+
+    # once full, the oldest values are overwritten but order is kept
+    for n in range(3, 10): ring.append(n)
+    np.testing.assert_array_equal(ring.recent(), [6, 7, 8, 9])
+    ring.append(10)
+    np.testing.assert_array_equal(ring.recent(), [7, 8, 9, 10])
+
+
+def test_drain_queue():
+    que = mp.Queue()
+    for n in range(5): que.put(n)
+    time.sleep(0.1)  # give the feeder thread time to flush
+
+    assert drain_queue(que, size=3) == [0, 1, 2]
+    assert drain_queue(que) == [3, 4]
+
+
+def test_drain_queue_empty():
+    # an empty queue blocks until the first item comes in
+    que = mp.Queue()
+    timer = threading.Timer(0.2, que.put, args=('a',))
+    timer.start()
+    start = time.time()
+    assert drain_queue(que) == ['a']
+    assert time.time() - start >= 0.15
+    timer.join()
+
+
+def test_load_biopac_csv_stale_cache(tmp_path):
+    fname = str(tmp_path / 'x_biopac_data.csv')
+    cache = str(tmp_path / 'x_biopac_data.npy')
+
+    with open(fname, 'w') as dest:
+        dest.write('time,channel1\n0,1\n2,3\n')
+    np.testing.assert_array_equal(load_biopac_csv(fname), [[0, 1], [2, 3]])
+    assert os.path.exists(cache)
+    np.testing.assert_array_equal(load_biopac_csv(fname, usecols=[1]),
+                                  [[1], [3]])
+
+    # rewriting the CSV makes the cache stale, so it shouldn't be used
+    with open(fname, 'w') as dest:
+        dest.write('time,channel1\n0,5\n2,7\n4,9\n')
+    mtime = os.path.getmtime(cache)
+    os.utime(fname, (mtime + 10, mtime + 10))
+    np.testing.assert_array_equal(load_biopac_csv(fname),
+                                  [[0, 5], [2, 7], [4, 9]])
+
+
+def test_load_biopac_csv_bad_cache(tmp_path):
+    fname = str(tmp_path / 'x_biopac_data.csv')
+    cache = str(tmp_path / 'x_biopac_data.npy')
+    with open(fname, 'w') as dest:
+        dest.write('time,channel1\n0,1\n2,3\n')
+    load_biopac_csv(fname)
+    size = os.path.getsize(cache)
+
+    # a truncated (e.g., partially written) cache is ignored and replaced
+    for length in (size - 8, 0):
+        with open(cache, 'r+b') as dest: dest.truncate(length)
+        np.testing.assert_array_equal(load_biopac_csv(fname), [[0, 1], [2, 3]])
+        assert os.path.getsize(cache) == size
+    assert sorted(os.listdir(str(tmp_path))) == ['x_biopac_data.csv',
+                                                 'x_biopac_data.npy']
+
+
+def ref_get_extrema(data, peaks=True):
+    """Original (pre-numba) `get_extrema()`, with a threshold of 0"""
+
+    if data.size == 1 or data.std(0).all() == 0:
+        data = data - data.mean(0)
+    else:
+        data = (data - data.mean(0)) / data.std(0)
+
+    if peaks: above_threshold_ind = np.where(data > 0)[0]
+    else: above_threshold_ind = np.where(data < 0)[0]
+
+    trend = np.sign(np.diff(data))
+    extrema_ind = np.where(trend == 0)[0]
+
+    # get only peaks, and fix flat peaks
+    for i in range(extrema_ind.size - 1, -1, -1):
+        if trend[min(extrema_ind[i] + 1, trend.size) - 1] >= 0:
+            trend[extrema_ind[i]] = 1
+        else:
+            trend[extrema_ind[i]] = -1
+
+    if peaks: extrema_ind = np.where(np.diff(trend) == -2)[0] + 1
+    else: extrema_ind = np.where(np.diff(trend) == 2)[0] + 1
+
+    return np.intersect1d(above_threshold_ind, extrema_ind)
+
+
+def ref_peak_or_trough(data, last, thresh, fs):
+    """Original (pre-numba) `peak_or_trough()`, given the last detection"""
+
+    divide = (data[-1, 0] - last[1]) / (thresh[0, 0] + thresh[0, 1])
+    divide = divide if divide > 1 else 1
+
+    tdiff = thresh[0, 0] - thresh[0, 1]
+    hdiff = (thresh[1, 0] - thresh[1, 1]) / divide
+
+    lookback = int(np.floor(tdiff / fs))
+    if lookback < 0: lookback = 5
+
+    if last[0] != 1:
+        peaks = ref_get_extrema(data[:, 1])
+        if len(peaks) > 0:
+            p = peaks[-1]
+            max_ = np.all(data[p, 1] >= data[p - lookback:p, 1])
+            sh = data[p, 1] - last[2]
+            rh = data[p, 0] - last[1]
+            if sh > hdiff and rh > tdiff and max_: return p, None
+
+    if last[0] != 0:
+        troughs = ref_get_extrema(data[:, 1], peaks=False)
+        if len(troughs) > 0:
+            t = troughs[-1]
+            min_ = np.all(data[t, 1] <= data[t - lookback:t, 1])
+            sh = data[t, 1] - last[2]
+            rh = data[t, 0] - last[1]
+            if sh < -hdiff and rh > tdiff and min_: return None, t
+
+    return None, None
+
+
+@pytest.mark.parametrize('use_numba', [True, False])
+@pytest.mark.parametrize('fname', ['t01', 't02', 't07'])
+def test_gen_detector(fname, use_numba, monkeypatch, tmp_path):
+    if use_numba and not utils.have_numba: pytest.skip('numba unavailable')
+    monkeypatch.setattr(utils, 'have_numba', use_numba)
+
+    # load copies of the data, so the .npy caches aren't written to (or shared
+    # between tests in) the package's data directory
+    for suffix in ('-run_baseline_MP150_data.csv', '-run1_MP150_data.csv'):
+        shutil.copy(op.join(op.dirname(__file__), 'data', fname + suffix),
+                    str(tmp_path))
+    fname = str(tmp_path / fname)
+
+    # seed detections with prominent extrema from the baseline data, as a
+    # stand-in for `get_baseline()` (which needs peakdet)
+    base = load_biopac_csv(fname + '-run_baseline_MP150_data.csv',
+                           usecols=[0, 1])[::2]
+    prom = base[:, 1].std()
+    p, _ = find_peaks(base[:, 1], prominence=prom)
+    t, _ = find_peaks(-base[:, 1], prominence=prom)
+    out = np.vstack((np.column_stack((np.ones(p.size), base[p])),
+                     np.column_stack((np.zeros(t.size), base[t]))))
+    out = out[np.argsort(out[:, 1])]
+
+    # first 40 sec of data, downsampled to 500 Hz
+    data = np.asarray(load_biopac_csv(fname + '-run1_MP150_data.csv',
+                                      usecols=[0, 1])[:40000:2])
+    st = 2.
+
+    found = AppendBuffer(3)
+    found.extend(out)
+    found.view()[-1, 1] = data[0, 0] - gen_thresh(out[:-1])[0, 0]
+    start, ndet = 0, 0
+    while start < len(data) - 1:
+        last_found = found.view()
+        thresh = gen_thresh(last_found[:-1])
+        last = tuple(last_found[-1])
+        sig = data[start:]
+
+        # scan the rest of the data sample by sample with the original
+        # detector, and in one go with the new one
+        for k in range(1, len(sig)):
+            p, t = ref_peak_or_trough(sig[:k + 1], last, thresh, st)
+            if p is not None or t is not None: break
+        else:
+            k = len(sig)
+
+        stop, det, peak, ind = gen_detector(thresh, st)(sig, last, start=1)
+        assert stop == k
+        if not det: break
+        assert (peak, ind) == ((True, p) if p is not None else (False, t))
+        assert utils.peak_or_trough(sig[:k + 1], last, thresh, st) == (p, t)
+
+        found.append((int(peak), sig[ind, 0], sig[ind, 1]))
+        start, ndet = start + k, ndet + 1
+
+    assert ndet > 5
@@ -1,7 +1,25 @@
+import multiprocessing as mp
+import os
+import os.path as op
+from queue import Empty
+import tempfile
 import numpy as np
 
+# numba can be turned off (e.g., for debugging) by setting RTPEAKS_NUMBA=0
+try:
+    if os.environ.get('RTPEAKS_NUMBA', '1') == '0': raise ImportError
+    from numba import njit
+    have_numba = True
+except ImportError:
+    have_numba = False
 
-def peak_or_trough(data, last_found, thresh, fs):
+    def njit(*args, **kwargs):
+        """Stand-in for `numba.njit()` that leaves functions uncompiled"""
+
+        return lambda func: func
+
+
+def peak_or_trough(data, last, thresh, fs):
     """
     Helper function for rtp_finder()
 
@@ -12,9 +30,38 @@ def peak_or_trough(data, last_found, thresh, fs):
     ----------
     data : (N x 2) array_like
         Array containing [time, data] since last peak/trough detection
-    last_found : (N x 3) array_like
-        Array containing [type, time, amplitude] of previously detected
-        peaks/troughs
+    last : (3,) array_like
+        [type, time, amplitude] of most recently detected peak/trough
+    thresholds : (2 x 2) array_like
+        Array containing average (col 1) and standard deviation (col 2) of
+        time (row 1) and amplitude (row 2) thresholds for peak/trough detection
+    fs : float
+        Sampling rate
+
+    Returns
+    -------
+    int or None
+        Index of detected peak, if any
+    int or None
+        Index of detected trough, if any
+    """
+
+    _, found, peak, ind = gen_detector(thresh, fs)(data, last)
+    if not found: return None, None
+
+    return (ind, None) if peak else (None, ind)
+
+
+def gen_detector(thresh, fs):
+    """
+    Helper function for rtp_finder()
+
+    Generates a function equivalent to `peak_or_trough()` with everything that
+    depends only on `thresh` and `fs` computed up front, since these only
+    change when a peak/trough is detected.
+
+    Parameters
+    ----------
     thresholds : (2 x 2) array_like
         Array containing average (col 1) and standard deviation (col 2) of
         time (row 1) and amplitude (row 2) thresholds for peak/trough detection
@@ -23,53 +70,334 @@ def peak_or_trough(data, last_found, thresh, fs):
 
     Returns
     -------
-    bool
-        Whether a peak was detected
-    bool
-        Whether a trough was detected
+    function
+        Accepts `data` and `last` (as in `peak_or_trough()`), plus optional
+        `start` and `timeout`, and checks `data[:k + 1]` for each `k` from
+        `start` (default: only the last sample) onwards, stopping at the first
+        detection or the first sample more than `timeout` ms after `last`
+        (default: never). Returns (k, found, peak, index): where it stopped
+        (`len(data)` if it didn't), whether a peak/trough was detected,
+        whether it was a peak, and its index in `data` (-1 if not found)
     """
 
-    # if time since last detection > upper bound of normal time interval
-    # shrink height threshold by relative factor
-    divide = ((data[-1, 0] - last_found[-1, 1]) /
-              (thresh[0, 0] + thresh[0, 1]))
-    divide = divide if divide > 1 else 1
+    # upper bound of normal time interval
+    tupper = thresh[0, 0] + thresh[0, 1]
 
     tdiff = thresh[0, 0] - thresh[0, 1]
-    hdiff = (thresh[1, 0] - thresh[1, 1]) / divide
+    hbase = thresh[1, 0] - thresh[1, 1]
 
     # approximate # of samples between detections
     lookback = int(np.floor(tdiff / fs))
     if lookback < 0: lookback = 5  # if negative, let's lookback 5 samples
 
-    if last_found[-1, 0] != 1:  # if we're looking for a peak
-        peaks = get_extrema(data[:, 1])
-        if len(peaks) > 0:
-            p = peaks[-1]
-            # ensure peak is higher than previous `lookback` datapoints
-            max_ = np.all(data[p, 1] >= data[p - lookback:p, 1])
-            sh = data[p, 1] - last_found[-1, 2]
-            rh = data[p, 0] - last_found[-1, 1]
+    if have_numba:
+        # compiled version scans the whole batch in one call. it uses numpy's
+        # error model, so (as above) dividing by zero gives inf/nan and
+        # doesn't raise
+        def detector(data, last, start=None, timeout=np.inf):
+            if start is None: start = len(data) - 1
+            return _scan(data, start, float(last[0]), float(last[1]),
+                         float(last[2]), tupper, tdiff, hbase, lookback,
+                         float(timeout))
+
+        return detector
+
+    def detector(data, last, start=None, timeout=np.inf):
+        if start is None: start = len(data) - 1
+        for k in range(start, len(data)):
+            # extrema can't be any later than the current sample, so nothing
+            # can be detected until more than `tdiff` has passed since `last`
+            if data[k, 0] - last[1] > tdiff:
+                found, peak, ind = check(data[:k + 1], last)
+                if found: return k, found, peak, ind
+            if data[k, 0] - last[1] > timeout: return k, False, False, -1
+
+        return len(data), False, False, -1
+
+    def check(data, last):
+        last_type, last_time, last_amp = last
+
+        # if time since last detection > upper bound of normal time interval
+        # shrink height threshold by relative factor
+        divide = (data[-1, 0] - last_time) / tupper
+        divide = divide if divide > 1 else 1
+
+        hdiff = hbase / divide
+
+        # with a threshold of 0 peaks and troughs share a cutoff (the mean)
+        y = data[:, 1]
+        mean = y.mean()
+
+        if last_type != 1:  # if we're looking for a peak
+            p = _search_extrema(y, True, mean)
+            if p is not None:
+                # ensure peak is higher than previous `lookback` datapoints
+                max_ = np.all(data[p, 1] >= data[p - lookback:p, 1])
+                sh = data[p, 1] - last_amp
+                rh = data[p, 0] - last_time
+
+                if sh > hdiff and rh > tdiff and max_:
+                    return True, True, p
+
+        if last_type != 0:  # if we're looking for a trough
+            t = _search_extrema(y, False, mean)
+            if t is not None:
+                # ensure trough is lower than previous `lookback` datapoints
+                min_ = np.all(data[t, 1] <= data[t - lookback:t, 1])
+                sh = data[t, 1] - last_amp
+                rh = data[t, 0] - last_time
+
+                if sh < -hdiff and rh > tdiff and min_:
+                    return True, False, t
+
+        return False, False, -1
+
+    return detector
+
+
+def compile_kernels():
+    """
+    Compiles the numba kernels, if numba is available
+
+    Kernels are otherwise compiled (or loaded from numba's cache) the first
+    time they're called, which can hold up the first detection by seconds
+    """
+
+    if not have_numba: return
+
+    # use an AppendBuffer so the kernels get compiled for its memory layout
+    buf = AppendBuffer(2, capacity=16)
+    buf.extend(np.zeros((8, 2)))
+    gen_detector(np.ones((2, 2)), 1.)(buf.view(), (0., 0., 0.), start=0)
+    get_last_extremum(buf.view()[:, 1])
+
+
+@njit(nogil=True, cache=True, error_model='numpy')
+def _scan(data, start, last_type, last_time, last_amp, tupper, tdiff, hbase,
+          lookback, timeout):
+    """
+    Compiled equivalent of the function returned by `gen_detector()`
+
+    Returns
+    -------
+    int, bool, bool, int
+        Sample at which scanning stopped, whether a peak/trough was detected,
+        whether it was a peak, and its index in `data` (-1 if not found)
+    """
+
+    # keep a running sum of the amplitudes so that each sample only adds one
+    # value to the mean, rather than it being recomputed from scratch
+    total = 0.
+    for j in range(start): total += data[j, 1]
+
+    for k in range(start, data.shape[0]):
+        total += data[k, 1]
+        # as in `gen_detector()`, don't search until `tdiff` has passed
+        if data[k, 0] - last_time > tdiff:
+            found, peak, ind = _detect(data[:k + 1], total / (k + 1),
+                                       last_type, last_time, last_amp,
+                                       tupper, tdiff, hbase, lookback)
+            if found: return k, found, peak, ind
+        if data[k, 0] - last_time > timeout: return k, False, False, -1
+
+    return data.shape[0], False, False, -1
+
+
+@njit(nogil=True, cache=True, error_model='numpy')
+def _detect(data, mean, last_type, last_time, last_amp, tupper, tdiff, hbase,
+            lookback):
+    """
+    Checks whether a peak/trough can be detected at the end of `data`
+
+    Parameters
+    ----------
+    data : (N x 2) np.ndarray
+        Array containing [time, data] since last peak/trough detection
+    mean : float
+        Mean of `data[:, 1]`
+    last_type, last_time, last_amp : float
+        Type, time, and amplitude of most recently detected peak/trough
+    tupper, tdiff, hbase : float
+        Time/height thresholds, as computed in `gen_detector()`
+    lookback : int
+        Number of samples a peak/trough must dominate
+
+    Returns
+    -------
+    bool, bool, int
+        Whether a peak/trough was detected, whether it was a peak, and its
+        index in `data` (-1 if nothing was found)
+    """
+
+    divide = (data[-1, 0] - last_time) / tupper
+    if not divide > 1: divide = 1.  # also catches nan (e.g., tupper is 0)
+
+    hdiff = hbase / divide
+
+    # with a threshold of 0 peaks and troughs share a cutoff (the mean)
+    y = data[:, 1]
+    if y.size < 3: return False, False, -1
+
+    for peaks in (True, False):
+        if peaks and last_type == 1: continue
+        if not peaks and last_type == 0: continue
+
+        ex = _search_back(y, peaks, mean)
+        if ex < 0: continue
+
+        # ensure extremum dominates previous `lookback` datapoints
+        dominant = True
+        for val in data[ex - lookback:ex, 1]:
+            if (peaks and data[ex, 1] < val) or (not peaks and
+                                                 data[ex, 1] > val):
+                dominant = False
+                break
+
+        sh = data[ex, 1] - last_amp
+        rh = data[ex, 0] - last_time
+        high = sh > hdiff if peaks else sh < -hdiff
+
+        if high and rh > tdiff and dominant:
+            return True, peaks, ex
+
+    return False, False, -1
+
+
+@njit(nogil=True, cache=True, error_model='numpy')
+def _last_extremum(data, peaks, thresh=0.):
+    """
+    Compiled equivalent of `get_last_extremum(data, peaks, thresh)`
+
+    Parameters
+    ----------
+    data : (N,) np.ndarray
+    peaks : bool
+        Whether to look for peaks (True) or troughs (False)
+    thresh : (0,1) float, optional
+        Height threshold for peak/trough detection. Default: 0
+
+    Returns
+    -------
+    int
+        Index of last extremum in `data`, or -1 if there isn't one
+    """
+
+    if data.size < 3: return -1
+
+    # rather than normalizing `data`, un-normalize the cutoff (the standard
+    # deviation cancels out), collecting the mean and max/min in one pass
+    total, extreme = 0., data[0]
+    for val in data:
+        total += val
+        if (val > extreme) if peaks else (val < extreme): extreme = val
+    mean = total / data.size
+    cutoff = mean + (extreme - mean) * thresh
+
+    return _search_back(data, peaks, cutoff)
+
+
+@njit(nogil=True, cache=True, error_model='numpy')
+def _search_back(data, peaks, cutoff):
+    """
+    Compiled search for last extremum in `data` that passes `cutoff`
+
+    Parameters
+    ----------
+    data : (N,) np.ndarray
+    peaks : bool
+        Whether to look for peaks (True) or troughs (False)
+    cutoff : float
+        Height that peaks must be above (or troughs below)
+
+    Returns
+    -------
+    int
+        Index of last extremum in `data`, or -1 if there isn't one
+    """
+
+    for n in range(data.size - 2, 0, -1):
+        prev, curr, nxt = data[n - 1], data[n], data[n + 1]
+        if peaks:
+            if curr >= prev and nxt < curr and curr > cutoff: return n
+        elif curr < prev and nxt >= curr and curr < cutoff:
+            return n
+
+    return -1
+
+
+def drain_queue(que, size=64):
+    """
+    Gets up to `size` items from `que`, blocking only for the first
+
+    Parameters
+    ----------
+    que : multiprocessing.Queue
+        Queue from which to get items
+    size : int, optional
+        Maximum number of items to get. Default: 64
+
+    Returns
+    -------
+    list
+        Items from `que`, in the order they were received
+    """
+
+    items = [que.get()]
+    while len(items) < size:
+        try: items.append(que.get_nowait())
+        except Empty: break
+
+    return items
+
+
+def load_biopac_csv(fname, usecols=None):
+    """
+    Loads data file written by `biopac_log()`
+
+    The first time a file is loaded its contents are cached alongside it as a
+    .npy file, which later loads (e.g., re-running tests on the same data)
+    memory-map instead of parsing the CSV again. The cache is ignored if the
+    CSV has been modified since it was written, or if it can't be loaded.
+
+    Parameters
+    ----------
+    fname : str
+        Path to CSV file
+    usecols : list of int, optional
+        Which columns to return. Default: all columns
+
+    Returns
+    -------
+    np.ndarray
+        Data from `fname`
+    """
 
-            if sh > hdiff and rh > tdiff and max_:
-                return p, None
+    cache, data = op.splitext(fname)[0] + '.npy', None
+    if op.exists(cache) and op.getmtime(cache) >= op.getmtime(fname):
+        # e.g., a truncated cache; just fall back to parsing the CSV
+        try: data = np.load(cache, mmap_mode='r')
+        except (OSError, ValueError, EOFError): pass
 
-    if last_found[-1, 0] != 0:  # if we're looking for a trough
-        troughs = get_extrema(data[:, 1], peaks=False)
-        if len(troughs) > 0:
-            t = troughs[-1]
-            # ensure trough is lower than previous `lookback` datapoints
-            min_ = np.all(data[t, 1] <= data[t - lookback:t, 1])
-            sh = data[t, 1] - last_found[-1, 2]
-            rh = data[t, 0] - last_found[-1, 1]
+    if data is None:
+        data = np.loadtxt(fname, skiprows=1, delimiter=',', ndmin=2)
+        # write to a temporary file and move it into place, so a crash (or
+        # another process loading the same file) never sees a partial cache
+        try:
+            fd, tmp = tempfile.mkstemp(suffix='.npy', dir=op.dirname(cache))
+            try:
+                with os.fdopen(fd, 'wb') as dest: np.save(dest, data)
+                os.replace(tmp, cache)
+            except BaseException:
+                os.remove(tmp)
+                raise
+        except OSError: pass
 
-            if sh < -hdiff and rh > tdiff and min_:
-                return None, t
+    if usecols is None: return data
 
-    return None, None
+    return data[:, usecols]
 
 
-def gen_thresh(last_found):
+def gen_thresh(last_found, n_total=None):
     """
     Helper function for peak_or_trough()
 
@@ -81,6 +409,9 @@ def gen_thresh(last_found):
     last_found : (N x 3) array_like
         Array containing [type, time, amplitude] of previously detected
         peaks/troughs
+    n_total : int, optional
+        Number of detections `last_found` was taken from, if it only holds the
+        most recent of them. Default: `len(last_found)`
 
     Returns
     -------
@@ -88,34 +419,34 @@ def gen_thresh(last_found):
         [[avg time, std time], [avg height, std height]]
     """
 
-    output = np.zeros((2, 2))
-    for col in [1, 2]:
-        peaks = last_found[last_found[:, 0] == 1, col]
-        troughs = last_found[last_found[:, 0] == 0, col]
-
-        if peaks.size != troughs.size:
-            size = np.min([peaks.size, troughs.size])
-            dist = peaks[-size:] - troughs[-size:]
-        else:
-            dist = peaks - troughs
-
-        # get rid of gross outliers (likely caused by pauses in peak finding)
-        inds = np.logical_and(dist <= dist.mean() + dist.std() * 3,
-                              dist >= dist.mean() - dist.std() * 3)
-        dist = dist[inds]
-
-        # get weighted average and unbiased standard deviation
-        weights = np.linspace(1, 10, dist.size)
-        thresh = np.average(dist, weights=weights)
-        if last_found.shape[0] > 20:
-            variance = np.average((dist - thresh)**2,
-                                  weights=weights) * dist.size
-            stdev = np.sqrt(variance / (dist.size - 1)) * 2.5
-        else:
-            stdev = thresh / 2
-        output[col - 1] = [np.abs(thresh), stdev]
+    if n_total is None: n_total = last_found.shape[0]
+    types = last_found[:, 0]
+    peaks, troughs = last_found[types == 1, 1:], last_found[types == 0, 1:]
+    size = min(len(peaks), len(troughs))
+
+    # distances between the last `size` peaks and troughs, with a row each
+    # for time and height
+    dist = np.ascontiguousarray((peaks[len(peaks) - size:] -
+                                 troughs[len(troughs) - size:]).T)
+
+    # get rid of gross outliers (likely caused by pauses in peak finding)
+    mean, std = dist.mean(1, keepdims=True), dist.std(1, keepdims=True)
+    keep = np.logical_and(dist <= mean + std * 3, dist >= mean - std * 3)
+
+    # get weighted average and unbiased standard deviation, where weights go
+    # from 1 to 10 across the remaining distances (and outliers get 0)
+    n = keep.sum(1)
+    step = 9. / np.maximum(n - 1, 1)
+    weights = np.where(keep, (np.cumsum(keep, 1) - 1) * step[:, None] + 1, 0)
+    thresh = (weights * dist).sum(1) / weights.sum(1)
+    if n_total > 20:
+        variance = ((weights * (dist - thresh[:, None])**2).sum(1) /
+                    weights.sum(1) * n)
+        stdev = np.sqrt(variance / (n - 1)) * 2.5
+    else:
+        stdev = thresh / 2
 
-    return output
+    return np.column_stack((np.abs(thresh), stdev))
 
 
 def get_extrema(data, peaks=True, thresh=0):
@@ -140,29 +471,143 @@ def get_extrema(data, peaks=True, thresh=0):
     if thresh < 0 or thresh > 1:
         raise ValueError('Thresh must be in (0,1).')
 
-    data = normalize(data)
+    data = np.asarray(data)
+    cutoff = _cutoff(data, peaks, thresh)
+    extrema_ind = _find_extrema(data, peaks=peaks)
 
+    # only keep extrema that pass the threshold
     if peaks:
-        above_threshold_ind = np.where(data > data.max() * thresh)[0]
+        return extrema_ind[data[extrema_ind] > cutoff]
     else:
-        above_threshold_ind = np.where(data < data.min() * thresh)[0]
+        return extrema_ind[data[extrema_ind] < cutoff]
+
+
+def get_last_extremum(data, peaks=True, thresh=0, window=128):
+    """
+    Find last extremum in `data`, searching backwards from the end
+
+    Gives the same result as `get_extrema(data, peaks, thresh)[-1]`, but only
+    scans `window` samples at a time; since the last extremum is usually near
+    the end of `data` this rarely needs to look at more than the first window.
+    If numba is available this is done in a single compiled pass instead.
+
+    Parameters
+    ----------
+    data : (N,) array_like
+        Data sampled from BIOPAC
+    peaks : bool, optional
+        Whether to look for peaks (True) or troughs (False). Default: True
+    thresh : (0,1) float, optional
+        Height threshold for peak/trough detection. Default: 0
+    window : int, optional
+        Number of samples to scan at a time; must be at least 3. Default: 128
+
+    Returns
+    -------
+    int or None
+        Index of last extremum in `data`, or None if there isn't one
+    """
+
+    if thresh < 0 or thresh > 1:
+        raise ValueError('Thresh must be in (0,1).')
+
+    if have_numba:
+        ind = _last_extremum(np.ascontiguousarray(data, dtype='float64'),
+                             peaks, float(thresh))
+        return ind if ind >= 0 else None
+
+    data = np.asarray(data)
+
+    return _search_extrema(data, peaks, _cutoff(data, peaks, thresh), window)
 
-    trend = np.sign(np.diff(data))
-    extrema_ind = np.where(trend == 0)[0]
 
-    # get only peaks, and fix flat peaks
-    for i in range(extrema_ind.size - 1, -1, -1):
-        if trend[min(extrema_ind[i] + 1, trend.size) - 1] >= 0:
-            trend[extrema_ind[i]] = 1
+def _search_extrema(data, peaks, cutoff, window=128):
+    """
+    Searches backwards through `data` for last extremum that passes `cutoff`
+
+    Parameters
+    ----------
+    data : (N,) np.ndarray
+    peaks : bool
+        Whether to look for peaks (True) or troughs (False)
+    cutoff : float
+        Height that peaks must be above (or troughs below)
+    window : int, optional
+        Number of samples to scan at a time; must be at least 3. Default: 128
+
+    Returns
+    -------
+    int or None
+        Index of last extremum in `data`, or None if there isn't one
+    """
+
+    # consecutive windows overlap by two samples so that every point gets
+    # compared against both of its neighbours
+    stop = data.size
+    while stop > 2:
+        start = max(stop - window, 0)
+        extrema_ind = _find_extrema(data[start:stop], peaks=peaks) + start
+        if peaks:
+            extrema_ind = extrema_ind[data[extrema_ind] > cutoff]
         else:
-            trend[extrema_ind[i]] = -1
+            extrema_ind = extrema_ind[data[extrema_ind] < cutoff]
+        if extrema_ind.size > 0: return extrema_ind[-1]
+        stop = start + 2
 
+
+def _cutoff(data, peaks=True, thresh=0):
+    """
+    Gets height an extremum in `data` must pass to meet `thresh`
+
+    Equivalent to `normalize(data).max() * thresh` (or `.min()` for troughs),
+    but in the units of `data` so that it doesn't need to be normalized
+
+    Parameters
+    ----------
+    data : (N,) np.ndarray
+    peaks : bool, optional
+        Whether to look for peaks (True) or troughs (False). Default: True
+    thresh : (0,1) float, optional
+        Height threshold for peak/trough detection. Default: 0
+
+    Returns
+    -------
+    float
+        Cutoff for extrema in `data`
+    """
+
+    # with no threshold extrema only need to be above (below) the mean, so
+    # there's no need for another pass to find the max (min)
+    mean = data.mean()
+    if thresh == 0: return mean
+    extreme = data.max() if peaks else data.min()
+
+    return mean + (extreme - mean) * thresh
+
+
+def _find_extrema(data, peaks=True):
+    """
+    Finds local extrema in `data`, treating flat stretches as rising
+
+    Parameters
+    ----------
+    data : (N,) np.ndarray
+    peaks : bool, optional
+        Whether to look for peaks (True) or troughs (False). Default: True
+
+    Returns
+    -------
+    np.ndarray
+        Indices of extrema from `data`
+    """
+
+    # a peak is any point that is at least as high as the one before it and
+    # higher than the one after it (and vice versa for troughs)
+    prev, curr, nxt = data[:-2], data[1:-1], data[2:]
     if peaks:
-        extrema_ind = np.where(np.diff(trend) == -2)[0] + 1
+        return np.flatnonzero((curr >= prev) & (nxt < curr)) + 1
     else:
-        extrema_ind = np.where(np.diff(trend) == 2)[0] + 1
-
-    return np.intersect1d(above_threshold_ind, extrema_ind)
+        return np.flatnonzero((curr < prev) & (nxt >= curr)) + 1
 
 
 def normalize(data):
@@ -179,7 +624,181 @@ def normalize(data):
         Normalized data
     """
 
-    if data.size == 1 or data.std(0).all() == 0:
-        return data - data.mean(0)
+    mean, std = data.mean(0), data.std(0)
+    if data.size == 1 or std.all() == 0:
+        return data - mean
     else:
-        return (data - data.mean(0)) / data.std(0)
+        return (data - mean) / std
+
+
+class AppendBuffer:
+    """
+    Preallocated array that rows can be cheaply appended to
+
+    Rows are written into spare capacity rather than stacked onto a new array,
+    and capacity is doubled whenever it runs out, so appending is (amortized)
+    constant time. Data are stored column by column, so each column of
+    `view()` is contiguous in memory.
+
+    Parameters
+    ----------
+    ncols : int
+        Number of columns in each row
+    capacity : int, optional
+        Number of rows to initially allocate space for. Default: 1024
+
+    Methods
+    -------
+    append(), extend()
+        Add one/several rows to the end of the buffer
+    drop()
+        Remove rows from the start of the buffer
+    reset()
+        Empty the buffer, optionally refilling it with new rows
+    view()
+        Get the rows currently in the buffer
+    """
+
+    def __init__(self, ncols, capacity=1024):
+        # one row of `_data` per column of the buffer
+        self._data = np.empty((ncols, capacity))
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def _reserve(self, size):
+        """Grows buffer (by doubling) until it can hold `size` rows"""
+
+        capacity = self._data.shape[1]
+        if size <= capacity: return
+        while capacity < size: capacity *= 2
+        data = np.empty((len(self._data), capacity))
+        data[:, :self._n] = self._data[:, :self._n]
+        self._data = data
+
+    def append(self, row):
+        """
+        Adds `row` to end of buffer
+
+        Parameters
+        ----------
+        row : array_like
+            Row to add; must have `ncols` entries
+        """
+
+        if self._n == self._data.shape[1]: self._reserve(self._n + 1)
+        self._data[:, self._n] = row
+        self._n += 1
+
+    def extend(self, rows):
+        """
+        Adds `rows` to end of buffer
+
+        Parameters
+        ----------
+        rows : (N x ncols) array_like
+            Rows to add
+        """
+
+        rows = np.atleast_2d(rows)
+        self._reserve(self._n + len(rows))
+        self._data[:, self._n:self._n + len(rows)] = rows.T
+        self._n += len(rows)
+
+    def drop(self, n):
+        """
+        Removes first `n` rows from buffer, shifting the rest to the front
+
+        Parameters
+        ----------
+        n : int
+            Number of rows to remove
+        """
+
+        n = min(n, self._n)
+        self._data[:, :self._n - n] = self._data[:, n:self._n]
+        self._n -= n
+
+    def reset(self, rows=None):
+        """
+        Empties buffer, and then fills it with `rows` (if provided)
+
+        Parameters
+        ----------
+        rows : (N x ncols) array_like, optional
+            Rows to start the buffer over with. Default: None
+        """
+
+        self._n = 0
+        if rows is not None: self.extend(rows)
+
+    def view(self):
+        """
+        Returns rows currently in buffer
+
+        Returns
+        -------
+        (N x ncols) np.ndarray
+            View (not a copy!) of the rows in the buffer; it will be
+            overwritten by future calls to `append()`/`extend()`/`reset()`
+        """
+
+        return self._data[:, :self._n].T
+
+
+class SharedRing:
+    """
+    Fixed-size ring buffer of floats in shared memory
+
+    Only one process should append to the ring at a time, but it can be read
+    from any process it was passed to. Once full, new values overwrite the
+    oldest ones.
+
+    Parameters
+    ----------
+    capacity : int, optional
+        Number of values to hold. Default: 512
+
+    Methods
+    -------
+    append()
+        Add a value to the ring
+    recent()
+        Get the values currently in the ring
+    """
+
+    def __init__(self, capacity=512):
+        self._data = mp.RawArray('d', capacity)
+        self._head = mp.Value('L', 0)  # number of values ever appended
+
+    def append(self, val):
+        """
+        Adds `val` to ring, overwriting the oldest value if it is full
+
+        Parameters
+        ----------
+        val : float
+        """
+
+        with self._head.get_lock():
+            self._data[self._head.value % len(self._data)] = val
+            self._head.value += 1
+
+    def recent(self):
+        """
+        Returns values currently in ring
+
+        Returns
+        -------
+        np.ndarray
+            Copy of values in ring, from oldest to newest
+        """
+
+        with self._head.get_lock():
+            head = self._head.value
+            data = np.array(self._data[:])
+
+        if head <= len(data): return data[:head]
+
+        return np.roll(data, -(head % len(data)))
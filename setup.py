@@ -19,6 +19,7 @@ def main():
         description=ldict['DESCRIPTION'],
         maintainer=ldict['MAINTAINER'],
         download_url=ldict['DOWNLOAD_URL'],
+        python_requires=ldict['PYTHON_REQUIRES'],
         install_requires=ldict['INSTALL_REQUIRES'],
         packages=find_packages(exclude=['rtpeaks/tests']),
         package_data=ldict['PACKAGE_DATA'],